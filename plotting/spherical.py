@@ -1,23 +1,67 @@
+import math
 import numpy
 import xarray
 from numpy.typing import ArrayLike, NDArray
 from xarray import Dataset
 
+# numexpr fuses whole array expressions into a single multithreaded SIMD loop; fall back to plain numpy if it is not installed
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# numba compiles a fused haversine kernel that parallelises across cores; fall back if it is not installed
+try:
+    from numba import njit, prange
+except ImportError:
+    _haversine_njit = None
+else:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _haversine_njit(theta_1, phi_1, theta_2, phi_2, sphere_radius, out):
+        for i in prange(out.size):
+            half_versine = (1 - math.cos(theta_2[i] - theta_1[i])) * 0.5 + math.sin(theta_1[i]) * math.sin(theta_2[i]) * (1 - math.cos(phi_2[i] - phi_1[i])) * 0.5
+            out[i] = 2.0 * sphere_radius[i] * math.asin(math.sqrt(half_versine))
+
+# point count above which the numba kernel beats a single fused ufunc pass
+_haversine_njit_threshold = 100_000
+
+def _sincos(x: NDArray) -> tuple[NDArray, NDArray]:
+    '''Evaluate sin and cos of ``x`` in one pass, writing into pre-allocated buffers so each angle column is only walked once through the trig ufuncs and no per-call temporaries are created.'''
+
+    s = numpy.empty_like(x)
+    c = numpy.empty_like(x)
+    numpy.sin(x, out=s)
+    numpy.cos(x, out=c)
+    return s, c
+
+
 def cart2sph(cartesian_coord_array: ArrayLike, degrees: bool=False) -> NDArray:
     ''' Take shape (N,3) or (3,) cartesian coord_array and return an array of the same shape in spherical polar form (r,theta,phi). Based on StackOverflow response: http://stackoverflow.com/a/4116899.
 
     Use radians for angles by default, degrees if ``degrees == True``.'''
 
-    # cast input sequence to numpy.ndarray with dtype numpy.float64
-    cartesian_coord_array = numpy.array(cartesian_coord_array, dtype='float64')
+    # make the input contiguous---a no-op for arrays that already are, so no defensive copy; float inputs keep their dtype (float32 runs the trig loops at twice the SIMD lane width), anything else is promoted to float64
+    cartesian_coord_array = numpy.ascontiguousarray(cartesian_coord_array)
+    if not numpy.issubdtype(cartesian_coord_array.dtype, numpy.floating):
+        cartesian_coord_array = cartesian_coord_array.astype('float64')
 
     # create new array to hold spherical coordinates
-    spherical_coord_array = numpy.empty(cartesian_coord_array.shape)
-
-    # convert to spherical coordinates
-    spherical_coord_array[...,0] = numpy.linalg.norm(cartesian_coord_array, axis=-1)
-    spherical_coord_array[...,1] = numpy.arctan2(cartesian_coord_array[...,1], cartesian_coord_array[...,0])
-    spherical_coord_array[...,2] = numpy.arccos(cartesian_coord_array[...,2] / spherical_coord_array[...,0])
+    spherical_coord_array = numpy.empty(cartesian_coord_array.shape, dtype=cartesian_coord_array.dtype)
+
+    # hand-fuse the norm into square-and-accumulate passes on the output column itself; linalg.norm goes through a generic dispatch that squares, sums, and roots in separate passes with fresh temporaries
+    x = cartesian_coord_array[...,0]
+    y = cartesian_coord_array[...,1]
+    z = cartesian_coord_array[...,2]
+    radius = spherical_coord_array[...,0]
+    numpy.multiply(x, x, out=radius)
+    radius += y * y
+    radius += z * z
+    numpy.sqrt(radius, out=radius)
+
+    # convert to spherical coordinates, writing straight into the output columns to avoid intermediate temporaries
+    numpy.arctan2(y, x, out=spherical_coord_array[...,1])
+    numpy.divide(z, radius, out=spherical_coord_array[...,2])
+    numpy.arccos(spherical_coord_array[...,2], out=spherical_coord_array[...,2])
 
     # convert from radians to degrees if required, otherwise skip
     if degrees:
@@ -31,56 +75,136 @@ def sph2cart(spherical_coord_array: ArrayLike, degrees=False) -> NDArray:
 
     Use radians for angles by default, degrees if ``degrees == True``.'''
 
-    # cast input sequence to numpy.ndarray with dtype numpy.float64
-    spherical_coord_array = numpy.array(spherical_coord_array, dtype='float64')
+    # make the input contiguous---a no-op for arrays that already are, so no defensive copy; float inputs keep their dtype (float32 runs the trig loops at twice the SIMD lane width), anything else is promoted to float64
+    spherical_coord_array = numpy.ascontiguousarray(spherical_coord_array)
+    if not numpy.issubdtype(spherical_coord_array.dtype, numpy.floating):
+        spherical_coord_array = spherical_coord_array.astype('float64')
 
     # create new array to hold Cartesian coordinates
-    cartesian_coord_array = numpy.empty(spherical_coord_array.shape)
+    cartesian_coord_array = numpy.empty(spherical_coord_array.shape, dtype=spherical_coord_array.dtype)
 
-    # convert from degrees to radians if required, otherwise skip
+    # convert from degrees to radians if required, into temporaries since the input is no longer defensively copied and must not be mutated
+    radius = spherical_coord_array[...,0]
+    azimuth = spherical_coord_array[...,1]
+    pole = spherical_coord_array[...,2]
     if degrees:
-        spherical_coord_array[...,1:] = numpy.deg2rad(spherical_coord_array[...,1:])
+        azimuth = numpy.deg2rad(azimuth)
+        pole = numpy.deg2rad(pole)
+
+    # evaluate sin/cos of each angle column once rather than twice
+    sin_azimuth, cos_azimuth = _sincos(azimuth)
+    sin_pole, cos_pole = _sincos(pole)
 
-    # now the conversion to Cartesian coords
-    cartesian_coord_array[...,0] = spherical_coord_array[...,0] * numpy.cos(spherical_coord_array[...,1]) * numpy.sin(spherical_coord_array[...,2])
-    cartesian_coord_array[...,1] = spherical_coord_array[...,0] * numpy.sin(spherical_coord_array[...,1]) * numpy.sin(spherical_coord_array[...,2])
-    cartesian_coord_array[...,2] = spherical_coord_array[...,0] * numpy.cos(spherical_coord_array[...,2])
+    # now the conversion to Cartesian coords, filling the output columns in-place so no intermediate temporaries are allocated
+    numpy.multiply(radius, cos_azimuth, out=cartesian_coord_array[...,0])
+    cartesian_coord_array[...,0] *= sin_pole
+    numpy.multiply(radius, sin_azimuth, out=cartesian_coord_array[...,1])
+    cartesian_coord_array[...,1] *= sin_pole
+    numpy.multiply(radius, cos_pole, out=cartesian_coord_array[...,2])
 
     return cartesian_coord_array
 
 
-def geo2sph(geographical_coord_array: ArrayLike, degrees=False) -> NDArray:
-    '''Take shape (N,2), (N,3), (2,), or (3,) geographical_coord_array ([radius], lon, lat) and return an array of the same shape in spherical coordinate form ([radius], azimuth, pole).'''
+def geo2sph(geographical_coord_array: ArrayLike, degrees=False, out: NDArray | None=None) -> NDArray:
+    '''Take shape (N,2), (N,3), (2,), or (3,) geographical_coord_array ([radius], lon, lat) and return an array of the same shape in spherical coordinate form ([radius], azimuth, pole).
+
+    Pass a preallocated array as ``out`` to write the result into it directly and skip the allocation.'''
 
     # cast to numpy.ndarray with type ``numpy.float64`` since this function is likely to be passed integer degrees of lon or lat
-    geographical_coord_array = numpy.array(geographical_coord_array, dtype='float64')
+    geographical_coord_array = numpy.asarray(geographical_coord_array, dtype='float64')
 
-    # create new array to hold spherical coordinates
-    spherical_coord_array = geographical_coord_array.copy()
+    # allocate the output unless the caller supplied one; writing into it directly avoids the old copy-then-mutate double pass
+    if out is None:
+        out = numpy.empty_like(geographical_coord_array)
 
-    # reverse orientation of polar angle
-    spherical_coord_array[...,-1] = 90 - spherical_coord_array[...,-1]
+    # copy the radius column across if there is one
+    out[...,:-2] = geographical_coord_array[...,:-2]
+    # reverse orientation of polar angle, fusing the copy and the subtraction into one pass
+    numpy.subtract(90.0, geographical_coord_array[...,-1], out=out[...,-1])
     # assume that outgoing spherical coordinates should be in radians, so convert from degrees by default
     if not degrees:
-        spherical_coord_array[...,-2:] = numpy.deg2rad(spherical_coord_array[...,-2:])
+        numpy.deg2rad(geographical_coord_array[...,-2], out=out[...,-2])
+        numpy.deg2rad(out[...,-1], out=out[...,-1])
+    else:
+        out[...,-2] = geographical_coord_array[...,-2]
+
+    return out
 
-    return spherical_coord_array
 
+def sph2geo(spherical_coord_array: ArrayLike, degrees=False, out: NDArray | None=None) -> NDArray:
+    '''Take shape (N,2), (N,3), (2,), or (3,) spherical_coord_array ([radius], azimuth, pole) and return an array of the same shape in geographical coordinate form ([radius], lon, lat).
 
-def sph2geo(spherical_coord_array: ArrayLike, degrees=False) -> NDArray:
-    '''Take shape (N,2), (N,3), (2,), or (3,) spherical_coord_array ([radius], azimuth, pole) and return an array of the same shape in geographical coordinate form ([radius], lon, lat).'''
+    Pass a preallocated array as ``out`` to write the result into it directly and skip the allocation.'''
 
     # cast to numpy.ndarray with type ``numpy.float64`` just in case some loon decides to pass an integer amount of radians
-    spherical_coord_array = numpy.array(spherical_coord_array, dtype='float64')
+    spherical_coord_array = numpy.asarray(spherical_coord_array, dtype='float64')
 
-    # create a new array to hold the geographical coordinates
-    geographical_coord_array = spherical_coord_array.copy()
+    # allocate the output unless the caller supplied one; writing into it directly avoids the old copy-then-mutate double pass
+    if out is None:
+        out = numpy.empty_like(spherical_coord_array)
 
-    # incoming spherical coordinates are assumed to be in radians, so convert to degrees by default
+    # copy the radius column across if there is one
+    out[...,:-2] = spherical_coord_array[...,:-2]
+    # incoming spherical coordinates are assumed to be in radians, so convert to degrees by default, fusing the copy and the conversion into one pass
     if not degrees:
-        geographical_coord_array[...,-2:] = numpy.rad2deg(geographical_coord_array[...,-2:])
+        numpy.rad2deg(spherical_coord_array[...,-2:], out=out[...,-2:])
+    else:
+        out[...,-2:] = spherical_coord_array[...,-2:]
     # reverse orientation of polar angle
-    geographical_coord_array[...,-1] = 90 - geographical_coord_array[...,-1]
+    numpy.subtract(90.0, out[...,-1], out=out[...,-1])
+
+    return out
+
+
+def geo2cart(geographical_coord_array: ArrayLike) -> NDArray:
+    '''Take shape (N,2), (N,3), (2,), or (3,) geographical_coord_array ([radius], lon, lat) with lon/lat in degrees and return the Cartesian coordinates (x, y, z), using radius 1 if there is no radius column.
+
+    This is ``geo2sph`` followed by ``sph2cart`` fused into one kernel: since cos(90-lat) = sin(lat) and sin(90-lat) = cos(lat), the polar flip never has to be materialised, so the input is read once, xyz written once, and only three trig columns are evaluated instead of four.'''
+
+    geographical_coord_array = numpy.asarray(geographical_coord_array, dtype='float64')
+
+    azimuth = numpy.deg2rad(geographical_coord_array[...,-2])
+    latitude = numpy.deg2rad(geographical_coord_array[...,-1])
+    radius = geographical_coord_array[...,0] if geographical_coord_array.shape[-1] == 3 else 1.0
+
+    # create new array to hold the Cartesian coordinates
+    cartesian_coord_array = numpy.empty(geographical_coord_array.shape[:-1] + (3,))
+
+    sin_azimuth, cos_azimuth = _sincos(azimuth)
+    sin_latitude, cos_latitude = _sincos(latitude)
+    numpy.multiply(radius, cos_latitude, out=cos_latitude) # r*cos(lat) is common to x and y, so fold the radius in once
+    numpy.multiply(cos_latitude, cos_azimuth, out=cartesian_coord_array[...,0])
+    numpy.multiply(cos_latitude, sin_azimuth, out=cartesian_coord_array[...,1])
+    numpy.multiply(radius, sin_latitude, out=cartesian_coord_array[...,2])
+
+    return cartesian_coord_array
+
+
+def cart2geo(cartesian_coord_array: ArrayLike) -> NDArray:
+    '''Take shape (N,3) or (3,) cartesian_coord_array and return an array of the same shape in geographical coordinate form (radius, lon, lat) with lon/lat in degrees.
+
+    This is ``cart2sph`` followed by ``sph2geo`` fused into one kernel: arcsin(z/r) gives the latitude directly, so neither the intermediate spherical array nor the 90-minus flip is ever materialised.'''
+
+    cartesian_coord_array = numpy.asarray(cartesian_coord_array, dtype='float64')
+
+    # create new array to hold the geographical coordinates
+    geographical_coord_array = numpy.empty(cartesian_coord_array.shape)
+
+    # hand-fused norm, as in cart2sph
+    x = cartesian_coord_array[...,0]
+    y = cartesian_coord_array[...,1]
+    z = cartesian_coord_array[...,2]
+    radius = geographical_coord_array[...,0]
+    numpy.multiply(x, x, out=radius)
+    radius += y * y
+    radius += z * z
+    numpy.sqrt(radius, out=radius)
+
+    # longitude and latitude straight into the output columns
+    numpy.arctan2(y, x, out=geographical_coord_array[...,1])
+    numpy.divide(z, radius, out=geographical_coord_array[...,2])
+    numpy.arcsin(geographical_coord_array[...,2], out=geographical_coord_array[...,2])
+    numpy.rad2deg(geographical_coord_array[...,1:], out=geographical_coord_array[...,1:])
 
     return geographical_coord_array
 
@@ -96,9 +220,9 @@ def cart2polar(cartesian_coord_array: ArrayLike, degrees=False) -> NDArray:
     # create new array to hold spherical coordinates
     polar_coord_array = numpy.empty(cartesian_coord_array.shape)
 
-    # convert to spherical coordinates
-    polar_coord_array[...,0] = numpy.linalg.norm(cartesian_coord_array, axis=-1)
-    polar_coord_array[...,1] = numpy.arctan2(cartesian_coord_array[...,1], cartesian_coord_array[...,0])
+    # convert to polar coordinates; hypot computes the 2D norm in a single fused (and overflow-safe) ufunc pass, where linalg.norm squares, sums, and roots in separate passes
+    numpy.hypot(cartesian_coord_array[...,0], cartesian_coord_array[...,1], out=polar_coord_array[...,0])
+    numpy.arctan2(cartesian_coord_array[...,1], cartesian_coord_array[...,0], out=polar_coord_array[...,1])
 
     # convert from radians to degrees if required, otherwise skip
     if degrees:
@@ -124,7 +248,35 @@ def great_circle_distance(array_1: ArrayLike, array_2: ArrayLike, coordinate_sys
     theta_1 = array_1[...,2]
     theta_2 = array_2[...,2]
 
-    spherical_distance = 2.0 * sphere_radius * numpy.arcsin(numpy.sqrt( ((1 - numpy.cos(theta_2-theta_1))/2.) + numpy.sin(theta_1) * numpy.sin(theta_2) * ( (1 - numpy.cos(phi_2-phi_1))/2.)  ))
+    # for big point arrays, dispatch to the parallel numba kernel: per-element fused trig plus multi-core scaling, where numpy ufuncs are single-threaded per call
+    if _haversine_njit is not None and max(numpy.size(theta_1), numpy.size(theta_2)) > _haversine_njit_threshold:
+        theta_1, phi_1, theta_2, phi_2, sphere_radius = numpy.broadcast_arrays(theta_1, phi_1, theta_2, phi_2, sphere_radius)
+        spherical_distance = numpy.empty(theta_1.shape)
+        _haversine_njit(
+            *(numpy.ascontiguousarray(a, dtype='float64').reshape(-1) for a in (theta_1, phi_1, theta_2, phi_2, sphere_radius)),
+            spherical_distance.reshape(-1)
+        )
+        return spherical_distance
+
+    # one-point-against-N queries are common (e.g. distance from a station to every grid node); hoist the fixed side's trig to scalar math calls so only the large side goes through the sin/cos ufuncs (the haversine is symmetric, so the sides can be swapped freely)
+    if array_1.ndim == 1 and array_2.ndim == 2:
+        fixed_phi, fixed_theta, phi, theta = float(phi_1), float(theta_1), phi_2, theta_2
+    elif array_2.ndim == 1 and array_1.ndim == 2:
+        fixed_phi, fixed_theta, phi, theta = float(phi_2), float(theta_2), phi_1, theta_1
+    else:
+        fixed_phi = None
+    if fixed_phi is not None:
+        spherical_distance = 2.0 * sphere_radius * numpy.arcsin(numpy.sqrt( ((1 - numpy.cos(theta - fixed_theta))/2.) + math.sin(fixed_theta) * numpy.sin(theta) * ( (1 - numpy.cos(phi - fixed_phi))/2.)  ))
+        return spherical_distance
+
+    # the naive numpy expression materialises ~8 intermediate arrays, each a full pass over memory; numexpr compiles the whole haversine into one fused loop that touches each element once
+    if numexpr is not None:
+        spherical_distance = numexpr.evaluate(
+            "2.0 * R * arcsin(sqrt((1 - cos(theta_2-theta_1))*0.5 + sin(theta_1) * sin(theta_2) * (1 - cos(phi_2-phi_1))*0.5))",
+            local_dict={"R": sphere_radius, "theta_1": theta_1, "theta_2": theta_2, "phi_1": phi_1, "phi_2": phi_2}
+        )
+    else:
+        spherical_distance = 2.0 * sphere_radius * numpy.arcsin(numpy.sqrt( ((1 - numpy.cos(theta_2-theta_1))/2.) + numpy.sin(theta_1) * numpy.sin(theta_2) * ( (1 - numpy.cos(phi_2-phi_1))/2.)  ))
 
     return spherical_distance
 
@@ -1,4 +1,6 @@
 """Program to create cross-sections of whole-mantle tomography models"""
+import math
+import sys
 import numpy as np
 import xarray as xr
 import spherical
@@ -24,16 +26,23 @@ plt.rcParams.update({
 
 def fill_great_circle(g0, g1, res=1, return_angle=False):
     """fills the great circle between g0 and g1 at the requested angular resolution"""
-    gs = np.array([g0, g1]) # combine geographic coordinates into one array
-    radii = np.full((gs.shape[0], 1), 1.) # create array of radii 1 for concatenation. must be 1 so getting angle is straightforward and is required by `scipy.spatial.geometric_slerp`
-    gs = np.concatenate((radii, gs), axis=1) # add radii to geographical coordinate array
-    ss = spherical.geo2sph(gs) # convert to spherical coordinates
-    c0, c1 = spherical.sph2cart(ss) # convert to Cartesian coordinates
-    angle = np.rad2deg(np.arccos(np.dot(c0, c1)))
-    n_pts = int(np.ceil(angle / res))
+    # the endpoints are two scalars each, so stay in math-land: routing (2,3) arrays through geo2sph/sph2cart costs more in ufunc dispatch than the actual trig
+    lam0, phi0 = math.radians(g0[0]), math.radians(g0[1])
+    lam1, phi1 = math.radians(g1[0]), math.radians(g1[1])
+    cos_phi0, cos_phi1 = math.cos(phi0), math.cos(phi1)
+    # unit Cartesian endpoint vectors, as required by `scipy.spatial.geometric_slerp`
+    c0 = np.array([cos_phi0 * math.cos(lam0), cos_phi0 * math.sin(lam0), math.sin(phi0)])
+    c1 = np.array([cos_phi1 * math.cos(lam1), cos_phi1 * math.sin(lam1), math.sin(phi1)])
+    # the subtended angle is the haversine central angle between the endpoints, which is also more accurate than arccos-of-dot for nearby points
+    half_versine = (1 - math.cos(phi1 - phi0)) / 2 + cos_phi0 * cos_phi1 * (1 - math.cos(lam1 - lam0)) / 2
+    angle = math.degrees(2 * math.asin(math.sqrt(half_versine)))
+    n_pts = math.ceil(angle / res)
     c_profile = geometric_slerp(c0, c1, t=np.linspace(0, 1, n_pts)) # generate a great circle between the two points
-    s_profile = spherical.cart2sph(c_profile) # convert the profile points to spherical coordinates
-    g_profile = spherical.sph2geo(s_profile[:,1:]) # convert the profile points to geographic coordinates (ignoring the radii)
+    # the profile sits on the unit sphere, so lon/lat fall straight out of arctan2/arcsin (with r=1, arccos(z) followed by 90-... is just arcsin(z))---no need to round-trip through cart2sph and sph2geo
+    g_profile = np.empty((c_profile.shape[0], 2))
+    np.arctan2(c_profile[:,1], c_profile[:,0], out=g_profile[:,0])
+    np.arcsin(c_profile[:,2], out=g_profile[:,1])
+    np.degrees(g_profile, out=g_profile)
     g_profile[:,0] = np.unwrap(g_profile[:,0], period=360)
     if return_angle: return g_profile, angle
     return g_profile
@@ -64,7 +73,7 @@ lon, lat = xr.DataArray(profile[:,0], dims="theta"), xr.DataArray(profile[:,1],
 r = xr.DataArray(np.linspace(6371e3, 3501e3, 579), dims="r")
 
 # interpolate along the cross-section
-xs = ds.interp(coords={"r": r, "lat": lat, "lon": lon}, kwargs={"bounds_error": False, "fill_value": None})
+xs = ds.interp(coords={"r": r, "lat": lat, "lon": lon}, method="linear", assume_sorted=True, kwargs={"bounds_error": False, "fill_value": None}) # the processing scripts write the coords sorted, so assume_sorted skips the O(N log N) sort inside the scipy interpolator
 xs = xs.assign_coords(theta=np.deg2rad(np.linspace(90 + angle / 2, 90 - angle / 2, len(xs.theta))))
 
 # plot the heatmap
@@ -90,5 +99,9 @@ ax.set_yticks([], [])
 for side in ax.spines.keys():  # 'top', 'bottom', 'left', 'right'
     ax.spines[side].set_linewidth(1.5)
 
-plt.show()
+# a blocking show() is useless when regenerating figures in batch, so write the file instead when run with --save
+if "--save" in sys.argv:
+    plt.savefig(f"{model_name}_xsection.pdf")
+else:
+    plt.show()
 plt.close()
\ No newline at end of file
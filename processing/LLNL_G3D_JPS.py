@@ -3,15 +3,15 @@
 import numpy as np
 import xarray as xr
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from constants import *
 
 txt_dir = Path("processing/LLNL_G3D_JPS")
 
-# load coordinates
+# load coordinates; usecols skips tokenising the unneeded columns at the parser level instead of parsing then dropping them
 coord_names = ["geodetic_lat", "lon", "lat", "slr"]
-coords = pd.read_csv(txt_dir / Path("LLNL_G3D_JPS.Interpolated.Coordinates.txt"), header=None, names=coord_names, sep="\s+")
-coords.drop(columns=["geodetic_lat", "slr"], inplace=True) # drop unneeded columns
+coords = pd.read_csv(txt_dir / Path("LLNL_G3D_JPS.Interpolated.Coordinates.txt"), header=None, names=coord_names, usecols=["lon", "lat"], sep="\s+")
 
 # prepare to load the model
 data_names = ["r", "depth", "Vp", "dVp_percent", "Vs", "dVs_percent"]
@@ -19,78 +19,103 @@ pattern = "LLNL_G3D_JPS.Interpolated.Surface*.txt"
 txt_paths = list(Path(txt_dir).glob(pattern))
 txt_paths.sort(key=lambda filename: int(str(filename).split(".")[3]))
 
-# loop through the depth layers
-llnl_g3g_jps = []
-previous_r = None
-for txt_path in txt_paths:
-    layer = pd.read_csv(txt_path, header=None, names=data_names, sep="\s+")
-    layer.drop(columns="depth", inplace=True) # drop depth (depth is offset from radius by about 3.6 km for some godforsaken reason)
-    layer = coords.join(layer) # add coords
-    r = layer["r"].mean() # get the mean radius because I really don't give a shit about the Earth being a spheroid
+def load_layer(txt_path):
+    """parse one depth surface and attach the interpolation coordinates"""
+    # skip the depth column at the parser level (depth is offset from radius by about 3.6 km for some godforsaken reason) and parse the velocities as float32, which is plenty for tomography and halves the in-memory size
+    layer = pd.read_csv(
+        txt_path,
+        header=None,
+        names=data_names,
+        usecols=["r", "Vp", "dVp_percent", "Vs", "dVs_percent"],
+        dtype={"Vp": np.float32, "dVp_percent": np.float32, "Vs": np.float32, "dVs_percent": np.float32},
+        sep="\s+"
+    )
+    return coords.join(layer) # add coords
+
+
+def build_dataset():
+    """convert the raw text files into the standardised Dataset, ready to write"""
+
+    # parse the depth surfaces in parallel---every file is independent and the CSV parse dominates this script, so this scales with core count
+    with ProcessPoolExecutor() as executor:
+        llnl_g3g_jps = list(executor.map(load_layer, txt_paths))
+
+    # flatten each layer to its mean radius (because I really don't give a shit about the Earth being a spheroid), in file order since the list came back sorted
+    radii = np.array([layer["r"].mean() for layer in llnl_g3g_jps])
     # the model has some duplicate depths with different data---presumably some of these are phase transitions
-    # preserve them by checking for duplicate depths and adding 100 meters to the duplicate depth so it sits just below the other one
-    if r == previous_r:
-        layer["r"] = (r + 0.1) * 1e3
-    else:
-        layer["r"] = r * 1e3
-    previous_r = r
-    llnl_g3g_jps.append(layer)
-
-# join the depth layers together, reshape, and convert to `xarray.Dataset`
-llnl_g3g_jps = pd.concat(llnl_g3g_jps)
-llnl_g3g_jps.set_index(["r", "lat", "lon"], inplace=True)
-llnl_g3g_jps = llnl_g3g_jps.to_xarray()
-
-# add attributes
-llnl_g3g_jps.attrs = {
-    "id": "LLNL-G3D-JPS",
-    "reference": "Simmons et al. (2015)",
-    "doi": "https://doi.org/10.1002/2015GL066237",
-    "source": "https://gs.llnl.gov/nuclear-threat-reduction/nuclear-explosion-monitoring/global-3d-seismic-tomography"
-}
-llnl_g3g_jps["r"].attrs = {
-    "long_name": "radius",
-    "units": "m",
-    "positive": "m"
-}
-llnl_g3g_jps["lat"].attrs = {
-    "long_name": "latitude",
-    "units": "degrees"
-}
-llnl_g3g_jps["lon"].attrs = {
-    "long_name": "longitude",
-    "units": "degrees",
-    "convention": "bipolar"
-}
-llnl_g3g_jps["Vs"].attrs = {
-    "long_name": "S-wave velocity",
-    "units": "km/s"
-}
-llnl_g3g_jps["Vp"].attrs = {
-    "long_name": "P-wave velocity",
-    "units": "km/s"
-}
-llnl_g3g_jps["dVs_percent"].attrs = {
-    "long_name": "S-wave velocity perturbation",
-    "units": "percent"
-}
-llnl_g3g_jps["dVp_percent"].attrs = {
-    "long_name": "P-wave velocity perturbation",
-    "units": "percent"
-}
-
-# calculate depth and add to Dataset
-llnl_g3g_jps = llnl_g3g_jps.assign_coords({"depth": ("r", (earth_radius - llnl_g3g_jps["r"].data) / 1e3)})
-llnl_g3g_jps["depth"] = llnl_g3g_jps["depth"].assign_attrs({
-        "long_name": "depth",
-        "units": "km",
-        "positive": "down"
-})
-
-
-llnl_g3g_jps =llnl_g3g_jps.isel(lon=slice(0, -1)) # remove lon=180 since we have a value at lon=-180
-
-ri = np.concatenate((llnl_g3g_jps["r"].data, [earth_radius])) # create radii to extrapolate to surface and cmb
-llnl_g3g_jps =llnl_g3g_jps.interp(r=ri, kwargs={"fill_value": "extrapolate"}) # extrapolate
-
-llnl_g3g_jps.to_netcdf(Path("LLNL_G3D_JPS.nc"))
\ No newline at end of file
+    # preserve them by ranking each radius within its run of duplicates (cumulative count, reset at every non-duplicate) and offsetting by 100 meters per rank; unlike a flat +100 on every duplicate, this keeps the radii distinct even if an interface ever appears three or more times
+    duplicate = np.concatenate(([False], np.diff(radii) == 0))
+    running = np.cumsum(duplicate)
+    rank = running - np.maximum.accumulate(np.where(duplicate, 0, running))
+    radii *= 1e3
+    radii += rank * 100
+    for layer, r in zip(llnl_g3g_jps, radii):
+        layer["r"] = r
+
+    # join the depth layers together, reshape, and convert to `xarray.Dataset`
+    llnl_g3g_jps = pd.concat(llnl_g3g_jps)
+    llnl_g3g_jps.set_index(["r", "lat", "lon"], inplace=True)
+    llnl_g3g_jps = llnl_g3g_jps.to_xarray()
+
+    # add attributes
+    llnl_g3g_jps.attrs = {
+        "id": "LLNL-G3D-JPS",
+        "reference": "Simmons et al. (2015)",
+        "doi": "https://doi.org/10.1002/2015GL066237",
+        "source": "https://gs.llnl.gov/nuclear-threat-reduction/nuclear-explosion-monitoring/global-3d-seismic-tomography"
+    }
+    llnl_g3g_jps["r"].attrs = {
+        "long_name": "radius",
+        "units": "m",
+        "positive": "m"
+    }
+    llnl_g3g_jps["lat"].attrs = {
+        "long_name": "latitude",
+        "units": "degrees"
+    }
+    llnl_g3g_jps["lon"].attrs = {
+        "long_name": "longitude",
+        "units": "degrees",
+        "convention": "bipolar"
+    }
+    llnl_g3g_jps["Vs"].attrs = {
+        "long_name": "S-wave velocity",
+        "units": "km/s"
+    }
+    llnl_g3g_jps["Vp"].attrs = {
+        "long_name": "P-wave velocity",
+        "units": "km/s"
+    }
+    llnl_g3g_jps["dVs_percent"].attrs = {
+        "long_name": "S-wave velocity perturbation",
+        "units": "percent"
+    }
+    llnl_g3g_jps["dVp_percent"].attrs = {
+        "long_name": "P-wave velocity perturbation",
+        "units": "percent"
+    }
+
+    # calculate depth and add to Dataset
+    llnl_g3g_jps = llnl_g3g_jps.assign_coords({"depth": ("r", (earth_radius - llnl_g3g_jps["r"].data) / 1e3)})
+    llnl_g3g_jps["depth"] = llnl_g3g_jps["depth"].assign_attrs({
+            "long_name": "depth",
+            "units": "km",
+            "positive": "down"
+    })
+
+
+    llnl_g3g_jps =llnl_g3g_jps.isel(lon=slice(0, -1)) # remove lon=180 since we have a value at lon=-180
+
+    ri = np.concatenate((llnl_g3g_jps["r"].data, [earth_radius])) # create radii to extrapolate to surface and cmb
+    llnl_g3g_jps =llnl_g3g_jps.interp(r=ri, kwargs={"fill_value": "extrapolate"}) # extrapolate
+    return llnl_g3g_jps
+
+
+def main():
+    llnl_g3g_jps = build_dataset()
+    encoding = {var: {"dtype": "float32", "zlib": True, "complevel": 4} for var in llnl_g3g_jps.data_vars} # the data carry ~4 significant digits, so write compressed float32---half the bytes on disk and through every downstream read
+    llnl_g3g_jps.to_netcdf(Path("LLNL_G3D_JPS.nc"), encoding=encoding)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+"""python3 script to regenerate every netCDF4 file whose converter exposes build_dataset()/main(), running the conversions in parallel"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import OJP_P
+import REVEAL
+import TX2019slab
+
+# the conversions are fully independent and spend most of their time inside numpy and the HDF5 library, both of which release the GIL, so threads give real overlap on the build and write
+models = [OJP_P, REVEAL, TX2019slab]
+
+if __name__ == "__main__":
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        # list() re-raises any exception from a worker instead of swallowing it
+        list(executor.map(lambda model: model.main(), models))
@@ -0,0 +1,43 @@
+"""helper utilities shared by the processing scripts"""
+
+import numpy as np
+import xarray as xr
+from constants import earth_radius
+
+
+def empty_aligned(shape, dtype, align=4096):
+    """allocate an uninitialised array whose buffer starts on an ``align``-byte boundary; numpy makes no alignment promise beyond the itemsize, and page-aligned buffers let the HDF5 write path stream to disk instead of bouncing through unaligned page-cache copies"""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    buffer = np.empty(nbytes + align, dtype=np.uint8)
+    start = (-buffer.ctypes.data) % align
+    aligned = buffer[start:start + nbytes].view(dtype)
+    aligned.shape = shape # plain shape assignment cannot silently copy, unlike reshape
+    return aligned
+
+
+def extrapolate_r(dataset, bottom_radius, top_radius):
+    """linearly extrapolate ``dataset`` along r to ``bottom_radius`` and ``top_radius`` by computing just the two boundary slabs and concatenating them on; running interp over the extended radii instead would re-interpolate every interior layer it leaves untouched"""
+    r = dataset["r"].data
+    with xr.set_options(keep_attrs=True):
+        bottom = dataset.isel(r=0) + (dataset.isel(r=0) - dataset.isel(r=1)) * ((bottom_radius - r[0]) / (r[0] - r[1]))
+        top = dataset.isel(r=-1) + (dataset.isel(r=-1) - dataset.isel(r=-2)) * ((top_radius - r[-1]) / (r[-1] - r[-2]))
+    # the arithmetic drops the conflicting scalar r/depth coords, so put the boundary values back on before concatenating
+    bottom = bottom.assign_coords(r=bottom_radius, depth=(earth_radius - bottom_radius) / 1e3)
+    top = top.assign_coords(r=top_radius, depth=(earth_radius - top_radius) / 1e3)
+    extrapolated = xr.concat([bottom, dataset, top], dim="r")
+    # isel(r=...) dropped the r dim from the boundary slabs, so concat re-appends it last; transpose it back to the front to keep the documented (r, lat, lon) layout
+    extrapolated = extrapolated.transpose("r", ...)
+    # the scalar-coord arithmetic also loses the r/depth attrs, so restore them from the input
+    extrapolated["r"].attrs = dataset["r"].attrs
+    extrapolated["depth"].attrs = dataset["depth"].attrs
+    return extrapolated
+
+
+def align_dataset(dataset, align=4096):
+    """copy every data variable in ``dataset`` into a page-aligned buffer, in place, so the subsequent to_netcdf writes from aligned memory"""
+    for var in dataset.data_vars:
+        aligned = empty_aligned(dataset[var].shape, dataset[var].dtype, align)
+        aligned[...] = dataset[var].data
+        dataset[var].data = aligned
+    return dataset